@@ -20,10 +20,9 @@ first position.
 we query it using a "new API" endpoint.
 
 After all these complications, it might make sense to finally introduce
-classes for representing records (rather than dictionaries, the keys of
-which are defined through the namespace in the parse_landing_page
-function...) and probably the whole collection, too (rather than a simple
-list).  MD might do this if there's another feature request...
+classes for representing records (rather than dictionaries) and probably
+the whole collection, too (rather than a simple list).  MD might do this
+if there's another feature request...
 
 
 Distributed by the IVOA under CC0, https://spdx.org/licenses/CC0-1.0.html
@@ -31,20 +30,36 @@ Distributed by the IVOA under CC0, https://spdx.org/licenses/CC0-1.0.html
 
 import argparse
 import cgi
+import collections
+import concurrent.futures
+import email.message
+import functools
+import hashlib
+import io
 import itertools
-import json
 import os
+import pickle
 import re
 import sys
+import tempfile
 import traceback
 import urllib.parse
 
-from bs4 import BeautifulSoup, NavigableString
+from lxml import html as lxml_html
 import requests
+from requests.adapters import HTTPAdapter
+
+try:
+	from orjson import loads as json_loads
+except ImportError:
+	from json import loads as json_loads
 
 
 CACHE_RESULTS = False
 
+# directory cached copies of web resources are kept in (see get_with_cache)
+CACHE_DIR = ".cache"
+
 # When two documents were published on the same date from authors
 # with the same initial, we need to reliably add a qualifier.
 # This is a dict of landing page URLs to qualifiers.  In the future,
@@ -60,9 +75,27 @@ BIBCODE_QUALIFIERS = {
 # endpoint of the ADS "bigquery" API
 ADS_ENDPOINT = "https://api.adsabs.harvard.edu/v1/search/bigquery?"
 
+# number of landing pages fetched in parallel
+FETCH_WORKERS = 16
+
+# all our HTTP goes through this session so connections are re-used
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=32, pool_maxsize=32))
+SESSION.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=32))
+
 
 ########################## Utilties
 
+# regular expressions used by the various string munging functions below
+_WS_RE = re.compile(r"\s+")
+_AND_RE = re.compile(r",? and ")
+_DOCPREFIX_RE = re.compile(".*documents/")
+_COVER_RE = re.compile("cover/")
+_INDEX_RE = re.compile("index.html")
+_SEG_RE = re.compile("[/-]")
+_INITIAL_RE = re.compile(r"[A-Z]\.$")
+_META_CHARSET_RE = re.compile(rb"<meta[^>]+charset", re.I)
+
 class Error(Exception):
 	"""Base class of exceptions raised by us.
 	"""
@@ -75,42 +108,126 @@ class ExternalError(Error):
 	"""is raised if some external service behaved unexpectedly.
 	"""
 
-class Finished(Exception):
-	"""used by the abstract collector to abort item collection in case of
-	malstructured documents.
+def get_declared_charset(response):
+	"""returns the charset given in the Content-Type header of a requests
+	response, or None if there is none.
 	"""
-	def __init__(self, payload):
-		self.payload = payload
-		Exception.__init__(self, "Unexpected div")
+	msg = email.message.Message()
+	msg["Content-Type"] = response.headers.get("Content-Type", "")
+	return msg.get_content_charset()
 
 
 def get_with_cache(url):
-	cacheName = re.sub("[^\w]+", "", url)+".cache"
-	if CACHE_RESULTS and os.path.exists(cacheName):
-		doc = open(cacheName, "r", encoding="utf-8").read()
-	else:
-		doc = requests.get(url).text
-		if CACHE_RESULTS:
-			with open(cacheName, "w", encoding="utf-8") as f:
-				f.write(doc)
-	return doc
+	"""returns the (undecoded) bytes of the resource at url and the charset
+	the server declared for it (or None).
+
+	Decoding is left to the HTML parser; see make_tree.
+
+	If CACHE_RESULTS is true, resources are kept in CACHE_DIR under a hash
+	of their URL, together with their ETag and charset.  When the server
+	gave us an ETag for a cached resource, we revalidate it with a
+	conditional request; otherwise, the cached copy is used without asking
+	the server.
+	"""
+	if not CACHE_RESULTS:
+		response = SESSION.get(url, timeout=30)
+		response.raise_for_status()
+		return response.content, get_declared_charset(response)
+
+	cache_name = os.path.join(CACHE_DIR,
+		hashlib.blake2b(url.encode("utf-8"), digest_size=16).hexdigest())
+
+	headers = {}
+	if os.path.exists(cache_name):
+		with open(cache_name, "rb") as f:
+			etag, charset, doc = pickle.load(f)
+		if etag is None:
+			return doc, charset
+		headers["If-None-Match"] = etag
+
+	response = SESSION.get(url, headers=headers, timeout=30)
+	if response.status_code==304:
+		return doc, charset
+	response.raise_for_status()
+
+	doc, charset = response.content, get_declared_charset(response)
+	# write to a temporary file first so an interrupted run cannot leave
+	# a truncated cache entry.
+	os.makedirs(CACHE_DIR, exist_ok=True)
+	fd, temp_name = tempfile.mkstemp(dir=CACHE_DIR)
+	try:
+		with os.fdopen(fd, "wb") as f:
+			pickle.dump((response.headers.get("ETag"), charset, doc), f)
+		os.replace(temp_name, cache_name)
+	except BaseException:
+		os.unlink(temp_name)
+		raise
+
+	return doc, charset
+
+
+def make_tree(doc, charset=None):
+	"""returns an lxml tree for the HTML bytes in doc.
+
+	charset is the encoding declared by the server, which takes precedence.
+	Without it, we let lxml look for a meta charset in the document, and if
+	there is none, we assume UTF-8 (lxml would use Latin-1).
 
+	We don't need comments, processing instructions, or an id index, so
+	we tell the parser not to bother with them.
 
-def get_enclosing_element(soup, tag, text):
+	>>> get_definition(make_tree("<dl><dt>Author(s):</dt>"
+	...   "<dd>René Descartes</dd></dl>".encode("utf-8")), "Author(s):")
+	'René Descartes'
+	"""
+	if charset is None and not _META_CHARSET_RE.search(doc):
+		charset = "utf-8"
+	# lxml parsers should not be shared between threads, so we
+	# make a new one each time.
+	parser = lxml_html.HTMLParser(encoding=charset,
+		remove_comments=True, remove_pis=True, collect_ids=False)
+	return lxml_html.fromstring(doc, parser=parser)
+
+
+def get_enclosing_element(tree, tag, text):
 	"""returns the first match of tag that contains an element containg
 	text.
+
+	tree is an lxml tree as returned by make_tree; if there is no such
+	element, None is returned.
+	"""
+	matches = tree.xpath("(//%s[contains(string(.), $text)])[1]"%tag,
+		text=text)
+	if matches:
+		return matches[0]
+
+
+def get_following(tree, tag, text, sibling_tag):
+	"""returns the first sibling_tag element following the first
+	match of tag that contains text.
+
+	This raises an IndexError if there is no such element.
+	"""
+	return tree.xpath(
+		"(//%s[contains(string(.), $text)])[1]/following-sibling::%s[1]"%(
+			tag, sibling_tag),
+		text=text)[0]
+
+
+def get_definition(tree, term):
+	"""returns the text of the dd following the first dt containing term.
 	"""
-	for el in soup.findAll(tag):
-		if text in el.text:
-			return el
+	return " ".join(get_following(tree, "dt", term, "dd").itertext())
 
 
 ########################## Screen scraping landing pages
 
 MONTH_NAMES = ["January", "February", "March", "April", "May", "June",
 	"July", "August", "September", "October", "November", "December"]
+# longest month names first so the regex engine backtracks less
 DATE_RE = re.compile(r"(\d{1,2})\s*(%s)\s*(\d\d\d\d)"%
-	"|".join(MONTH_NAMES))
+	"|".join(sorted(MONTH_NAMES, key=len, reverse=True)))
+MONTH_INDEX = dict((name, index+1) for index, name in enumerate(MONTH_NAMES))
 
 
 def parse_subhead_date(s):
@@ -121,65 +238,65 @@ def parse_subhead_date(s):
 	if not mat:
 		raise Exception("No date visible in %s"%repr(s))
 	return (int(mat.group(3)),
-		MONTH_NAMES.index(mat.group(2))+1,
+		MONTH_INDEX[mat.group(2)],
 		int(mat.group(1)))
 	
 
-def format_abstract(el):
-	"""returns plain text from a BeautifulSoup element.
+def _walk_abstract(el, out):
+	"""appends plain text from the lxml element el (not including its tail)
+	to the list out.
 
-	This traverses the tree, stopping when it encounters the first div.
-	Only very little markup is supported (all we have is ADS' abstract
-	syntax).
+	This traverses the tree, stopping when it encounters the first div;
+	in that case, False is returned, True otherwise.  Only very little
+	markup is supported (all we have is ADS' abstract syntax).
 	"""
-	accum = []
-
-	if isinstance(el, NavigableString):
-		accum.append(el.string)
-
-	elif el.name=="div":
+	if el.tag=="div":
 		# this is probably bad document structure, in that this div
 		# should not be a child of the abstract.  Stop collecting, but
-		# pass upstream what we've collected so far.
-		raise Finished(" ".join(accum))
+		# keep what we've collected so far.
+		return False
 
-	elif el.name in ("ul", "ol"):
+	elif el.tag in ("ul", "ol"):
 		# can't see a way to properly do ul in running text, so folding
 		# it to ol.
-		for index, child in enumerate(el.findAll("li", recursive=False)):
-			accum.append(" (%s) %s "%(index+1, format_abstract(child)))
+		for index, child in enumerate(el.findall("li")):
+			out.append(" (%s)"%(index+1))
+			if not _walk_abstract(child, out):
+				return False
+			out.append(" ")
 
 	else:
-		if el.name=="p":
-			accum.append("\n\n")
+		if el.tag=="p":
+			out.append("\n\n")
+		if el.text:
+			out.append(el.text)
 		for child in el:
-			try:
-				accum.append(format_abstract(child))
-			except Finished as rest:
-				raise Finished(" ".join(accum+[rest.payload]))
-	
-	return " ".join(accum)
+			# non-string tags are comments and processing instructions
+			if isinstance(child.tag, str):
+				if not _walk_abstract(child, out):
+					return False
+			if child.tail:
+				out.append(child.tail)
 
+	return True
 
-def get_abstract_text(soup):
-	"""returns a guess for what the abstract within soup is.
+
+def get_abstract_text(tree):
+	"""returns a guess for what the abstract within tree is.
 
 	Unfortunately, the abstract isn't marked up well on IVOA landing
 	pages.  Hence, we just look for the headline and gobble up material until
-	we reach a div after that.
+	we reach a div after that (or within that, in which case we suspect
+	a malformed document).
 	"""
-	abstract_head = get_enclosing_element(soup, "h2", "Abstract")
-	el = abstract_head.nextSibling
-	accum = []
-	while getattr(el, "name", None)!="div":
-		try:
-			accum.append(format_abstract(el))
-		except Finished as rest:
-			# div found as abstract child, suspect malformed document.
-			accum.append(rest.payload)
+	abstract_head = get_enclosing_element(tree, "h2", "Abstract")
+	out = [abstract_head.tail or ""]
+	for el in abstract_head.itersiblings():
+		if isinstance(el.tag, str) and not _walk_abstract(el, out):
 			break
-		el = el.nextSibling
-	return " ".join(accum)
+		if el.tail:
+			out.append(el.tail)
+	return " ".join(out)
 
 
 def clean_field(s):
@@ -189,14 +306,32 @@ def clean_field(s):
 	Don't do this to abstracts.
 	"""
 # Oh shucks, "Grid *and* Web Services" requires a special hack.
-	return re.sub(",? and ", ", ",
-		re.sub("\s+", " ", s)).replace("Grid, ", "Grid and")
+	return _AND_RE.sub(", ",
+		_WS_RE.sub(" ", s)).replace("Grid, ", "Grid and")
 
 
 SHORT_NAME_EXCEPTIONS = {
 	"VOT": "VOTable"
 }
 
+def _score_short_name_candidate(s):
+	"""returns a score for how likely s is a document short name.
+
+	That's the number of (ASCII) uppercase letters plus a fifth of the
+	number of lowercase letters.  This is a helper for guess_short_name.
+	"""
+	upper = lower = 0
+	for c in s:
+		if "A"<=c<="Z":
+			upper += 1
+		elif "a"<=c<="z":
+			lower += 1
+	return upper+lower/5.
+
+
+# there are only a few hundred docrepo URLs, so there's no need to
+# bound the cache.
+@functools.lru_cache(maxsize=None)
 def guess_short_name(url_in_docrepo):
 	"""guesses the short name of a document based on its docrepo URL.
 
@@ -211,51 +346,50 @@ def guess_short_name(url_in_docrepo):
 	'VOTable'
 	"""
 	# cut prefix
-	local_path = re.sub(".*documents/", "", url_in_docrepo)
+	local_path = _DOCPREFIX_RE.sub("", url_in_docrepo)
 	# cut known junk
-	unjunked = re.sub("index.html", "",
-		re.sub("cover/", "", local_path))
-	# score candidates according to
-	scored = list(sorted((
-			len(re.sub("[^A-Z]+", "", s))+len(re.sub("[^a-z]+", "", s))/5.
-			, s)
-		for s in re.split("[/-]", unjunked)))
+	unjunked = _INDEX_RE.sub("",
+		_COVER_RE.sub("", local_path))
+	candidates = _SEG_RE.split(unjunked)
+	scores = [_score_short_name_candidate(s) for s in candidates]
+	best_score = max(scores)
 	# fail if inconclusive
-	if len(scored)>1 and scored[-1][0]==scored[-2][0]:
+	if scores.count(best_score)>1:
 		raise Error("Cannot infer short name: %s"%url_in_docrepo)
-	
-	return SHORT_NAME_EXCEPTIONS.get(scored[-1][1], scored[-1][1])
+
+	short_name = candidates[scores.index(best_score)]
+	return SHORT_NAME_EXCEPTIONS.get(short_name, short_name)
 	
 
 def parse_landing_page(url, local_metadata):
 	"""returns a dictionary of document properties for a document taken from
 	its landing page.
 	"""
-	soup = BeautifulSoup(get_with_cache(url), 'html5lib')
-	authors = clean_field(
-		get_enclosing_element(soup, "dt", "Author(s):"
-			).findNextSibling("dd").getText(" "))
-	editors = clean_field(get_enclosing_element(soup, "dt", "Editor(s):"
-			).findNextSibling("dd").getText(" "))
-	tagline = soup.find("h2").text
-	date = parse_subhead_date(tagline)
-	abstract = get_abstract_text(soup).replace("\r", "")
-
-	title = clean_field(soup.find("h1").getText(" "))
-	journal = tagline
-
-	pdf_enclosure = get_enclosing_element(soup, "a", "PDF")
-	if pdf_enclosure:
-		pdf = urllib.parse.urljoin(url, pdf_enclosure.get("href"))
+	tree = make_tree(*get_with_cache(url))
+	authors = clean_field(get_definition(tree, "Author(s):"))
+	editors = clean_field(get_definition(tree, "Editor(s):"))
+	tagline = tree.find(".//h2").text_content()
+	res = {
+		"url": url,
+		"authors": authors,
+		"editors": editors,
+		"date": parse_subhead_date(tagline),
+		"abstract": get_abstract_text(tree).replace("\r", ""),
+		"title": clean_field(" ".join(tree.find(".//h1").itertext())),
+		"journal": tagline,
+	}
+
+	pdf_enclosure = get_enclosing_element(tree, "a", "PDF")
+	if pdf_enclosure is not None:
+		res["pdf"] = urllib.parse.urljoin(url, pdf_enclosure.get("href"))
 
 	try:
-		arXiv_id = local_metadata.get_arXiv_id_for_URL(url)
+		res["arXiv_id"] = local_metadata.get_arXiv_id_for_URL(url)
 	except KeyError:
 		# That's ok for notes, and checked separately for RECs
 		pass
 
-	del soup
-	return locals()
+	return res
 
 
 ########################## Screen scraping the index page
@@ -263,7 +397,7 @@ def parse_landing_page(url, local_metadata):
 def iter_links_from_table(src_table, rec_class):
 	"""returns rec-like URLs from src_table.
 
-	src_table is a BeautifulSoup node for one of our documents-in-progress
+	src_table is an lxml element for one of our documents-in-progress
 	tables (realistically, recommendations or endorsed notes).
 
 	rec_class is a CSS class name which marks links to finished standards
@@ -271,23 +405,24 @@ def iter_links_from_table(src_table, rec_class):
 
 	The function yields anchor elements.
 	"""
-	for links in src_table.findAll("td", {"class": "versionold"}):
-		for anchor in links.findAll("a", {"class": rec_class}):
-			yield anchor
+	return iter(src_table.xpath(
+		".//td[contains(concat(' ', normalize-space(@class), ' '),"
+			" ' versionold ')]"
+		"//a[contains(concat(' ', normalize-space(@class), ' '), $cls)]",
+		cls=" %s "%rec_class))
 
 
 def iter_REC_URLs(doc_index, repo_url):
 	"""iterates over URLs to RECs (different versions are different documents).
 
-	doc_index is a BeautifulSoup of the IVOA documents repo.  Each URL
+	doc_index is an lxml tree of the IVOA documents repo.  Each URL
 	in a class=rec anchor will be returned exactly once.  Document
 	order is maintained.
 	"""
 	seen_stds = set()
-	rec_table = get_enclosing_element(doc_index, "h3",
-		"Technical Specifications").findNextSibling("table")
-	en_table = get_enclosing_element(doc_index, "h3",
-		"Endorsed Note").findNextSibling("table")
+	rec_table = get_following(doc_index, "h3",
+		"Technical Specifications", "table")
+	en_table = get_following(doc_index, "h3", "Endorsed Note", "table")
 
 	for anchor in itertools.chain(
 			iter_links_from_table(rec_table, "rec"),
@@ -338,7 +473,7 @@ def parse_authors(literal):
 	Traceback (most recent call last):
 	ValueError: Unlikely author name 'Messy'
 	"""
-	if re.search(r"[A-Z]\.$", literal) or ";" in literal:
+	if _INITIAL_RE.search(literal) or ";" in literal:
 		res = literal.split(";")
 	else:
 		res = literal.split(",")
@@ -399,6 +534,8 @@ class Document(dict):
 		self["source"] = "IVOA"
 		self.validate()
 		self._perform_editor_hack()
+		self._authors_parsed = parse_authors(self["authors"])
+		self._first_surname = self._compute_first_surname()
 		self._infer_type()
 #		if self["type"]=="spec":
 #			if not self.get("arXiv_id"):
@@ -449,7 +586,8 @@ class Document(dict):
 		eds = parse_authors(self["editors"])
 		auths =  parse_authors(self["authors"])
 
-		non_editors = [item for item in auths if item not in eds]
+		eds_set = frozenset(eds)
+		non_editors = [item for item in auths if item not in eds_set]
 		if non_editors:
 			auths = eds+non_editors
 
@@ -463,18 +601,21 @@ class Document(dict):
 	_exceptional_surnames = {
 		"Preite Martinez"}
 
-	def get_first_author_surname(self):
+	def _compute_first_surname(self):
 		"""returns the surname for the first author.
 
 		This is pure heuristics -- we need it for bibcode generation, and
 		hence we should keep this in sync with what ADS wants.
+
+		This is called by the constructor; use get_first_author_surname
+		to access the result.
 		"""
 		# current heuristics for First Last-format authors: first character of last
 		# "word" of the first token parsed from authors (after the editor hack).
 		# This will fail for surnames consisting of multiple tokens.  We collect
 		# these in the _exceptional_surnames set above.
 
-		first_author = parse_authors(self["authors"])[0]
+		first_author = self._authors_parsed[0]
 		if "," in first_author:
 			# we're in luck: Last, F. format
 			return first_author.split(",")[0]
@@ -485,9 +626,19 @@ class Document(dict):
 
 		return first_author.split()[-1]
 
-	@property
+	def get_first_author_surname(self):
+		"""returns the surname for the first author.
+
+		See _compute_first_surname for how we get it.
+		"""
+		return self._first_surname
+
+	@functools.cached_property
 	def bibcode(self):
 		"""returns the bibcode for this record.
+
+		This is computed on first access; documents are not supposed to
+		change after construction.
 		"""
 		year, month, day = self["date"]
 		return "%sivoa.%s%s%02d%02d%s"%(
@@ -540,6 +691,13 @@ class DocumentCollection(object):
 	...   Document(TEST_DATA[k]) for k in "r1 r2 r3".split())
 	>>> dc.docs[0].bibcode
 	'2014ivoa.spec.0307J'
+	>>> [d["ivoadoc-id"] for d in DocumentCollection([
+	...   Document(TEST_DATA["r1"]), Document(TEST_DATA["r2"]),
+	...   Document(dict(TEST_DATA["r3"], journal="IVOA Recommendation"))])]
+	['ivoa:r.2014.03.00', 'ivoa:r.2014.03.01', 'ivoa:r.2014.05.00']
+	>>> DocumentCollection([Document(TEST_DATA["r1"]), Document(TEST_DATA["rr"])])
+	Traceback (most recent call last):
+	harvest.ValidationError: The following documents generated clashing bibcodes: http://foo/failrec and http://foo/bar.  Fix by adding one of them to BIBCODE_QUALIFIERS in the source.
 	"""
 	def __init__(self, docs):
 		self.docs = list(docs)
@@ -552,20 +710,37 @@ class DocumentCollection(object):
 		"""returns a DocumentCollection ready for export, constructed
 		from the index at root_url.
 		"""
-		doc_index = BeautifulSoup(requests.get(root_url).text, 'html5lib')
-		docs = []
-		
-		for url in itertools.chain(
+		response = SESSION.get(root_url, timeout=30)
+		response.raise_for_status()
+		doc_index = make_tree(response.content, get_declared_charset(response))
+		urls = list(itertools.chain(
 				iter_REC_URLs(doc_index, root_url),
-				iter_Notes_URLs()):
-			try:
-				docs.append(
-					Document.from_URL(urllib.parse.urljoin(root_url, url), local_metadata))
-			except KeyboardInterrupt:
-				raise
-			except:
-				sys.stderr.write("\nIn document %s:\n"%url)
-				traceback.print_exc()
+				iter_Notes_URLs()))
+		docs = []
+
+		# landing pages are fetched in parallel; order does not matter
+		# here, as the constructor sorts the documents anyway.
+		executor = concurrent.futures.ThreadPoolExecutor(
+			max_workers=FETCH_WORKERS)
+		url_for_future = dict(
+			(executor.submit(Document.from_URL,
+				urllib.parse.urljoin(root_url, url), local_metadata), url)
+			for url in urls)
+
+		try:
+			for future in concurrent.futures.as_completed(url_for_future):
+				try:
+					docs.append(future.result())
+				except Exception:
+					sys.stderr.write("\nIn document %s:\n"%url_for_future[future])
+					traceback.print_exc()
+		except KeyboardInterrupt:
+			# Ctrl-C arrives in this thread; don't wait for the queued
+			# fetches before giving up.
+			executor.shutdown(wait=False, cancel_futures=True)
+			raise
+
+		executor.shutdown()
 		return cls(docs)
 	
 	def __iter__(self):
@@ -576,11 +751,11 @@ class DocumentCollection(object):
 
 		Problems will lead to a validation error being raised.
 		"""
-		docs_per_bibcode = {}
+		docs_per_bibcode = collections.defaultdict(list)
 		for doc in self:
-			docs_per_bibcode.setdefault(doc.bibcode, []).append(doc)
-		dupes = [item for item in docs_per_bibcode.items()
-			if len(item[1])>1]
+			docs_per_bibcode[doc.bibcode].append(doc)
+		dupes = [(bibcode, docs) for bibcode, docs in docs_per_bibcode.items()
+			if len(docs)>1]
 		if dupes:
 			raise ValidationError("The following documents generated"
 				" clashing bibcodes: %s.  Fix by adding one of them to"
@@ -615,8 +790,8 @@ class DocumentCollection(object):
 		That is, sorted by date, authors, and titles, in that order.
 		This is called by the constructor.
 		"""
-		self.docs.sort(key=lambda rec: rec["date"]+(
-			rec.get_first_author_surname(), rec["title"]))
+		self.docs.sort(key=lambda rec: (
+			rec["date"], rec.get_first_author_surname(), rec["title"]))
 
 	def _get_month_partition(self):
 		"""returns a dictionary mapping (year, month) to the documents published
@@ -638,10 +813,11 @@ class DocumentCollection(object):
 		This is called by the constructor.
 		"""
 		for (year, month), recs in self._get_month_partition().items():
-			for index, rec in enumerate(d for d in self.docs if d["type"]=="spec"):
-				rec["ivoadoc-id"] = self._make_ivoadoc_id(rec, index)
-			for index, rec in enumerate(d for d in self.docs if d["type"]=="rept"):
-				rec["ivoadoc-id"] = self._make_ivoadoc_id(rec, index)
+			# recs are in _sort_recs order, so we can just count through
+			counts = {"spec": 0, "rept": 0}
+			for rec in recs:
+				rec["ivoadoc-id"] = self._make_ivoadoc_id(rec, counts[rec["type"]])
+				counts[rec["type"]] += 1
 
 
 ########################## local metadata injection
@@ -684,8 +860,11 @@ class LocalMetadata(object):
 ########################## ADS interface
 
 def filter_unpublished_bibcodes(bibcodes, auth):
-	"""returns a list of bibcodes not yet known to ADS from bibcodes.
+	"""returns a set of bibcodes not yet known to ADS from bibcodes.
+
+	bibcodes can be any iterable of strings.
 	"""
+	bibcodes = list(bibcodes)
 	params = {
 		'q': '*:*',
 		'rows': 1000,
@@ -694,19 +873,18 @@ def filter_unpublished_bibcodes(bibcodes, auth):
 		'fl': 'bibcode'}
 	payload = "bibcode\n"+"\n".join(bibcodes)
 
-	req = requests.post(ADS_ENDPOINT,
+	req = SESSION.post(ADS_ENDPOINT,
 		params=params,
 		headers={'Authorization': 'Bearer:%s'%auth},
-		data=payload)
-	response = json.loads(req.text)
+		data=payload,
+		timeout=60)
+	response = json_loads(req.content)
 
 	if response["responseHeader"]["status"]!=0:
 		raise ExternalError("ADS API returned error: %s"%repr(response))
 
-	known_bibcodes = set([r["bibcode"] for r in response["response"]["docs"]])
-	for bibcode in bibcodes:
-		if not bibcode in known_bibcodes:
-			yield bibcode
+	known_bibcodes = {r["bibcode"] for r in response["response"]["docs"]}
+	return set(bibcodes)-known_bibcodes
 
 
 ########################## command line interface
@@ -791,16 +969,21 @@ def main():
 
 	limit_to = None
 	if args.ads_token:
-		limit_to = set(filter_unpublished_bibcodes(
-			[doc.bibcode for doc in dc], args.ads_token))
-	
+		limit_to = filter_unpublished_bibcodes(
+			(doc.bibcode for doc in dc), args.ads_token)
+
+	# collect all output and write it in one go
+	buf = io.BytesIO()
 	for rec in dc:
 		if limit_to is not None:
 			if rec.bibcode not in limit_to:
 				continue
 
-		sys.stdout.buffer.write(rec.as_ADS_record().encode("utf-8"))
-		sys.stdout.write("")
+		buf.write(rec.as_ADS_record().encode("utf-8"))
+		buf.write(b"\n\n")
+
+	sys.stdout.buffer.write(buf.getvalue())
+	sys.stdout.buffer.flush()
 
 
 if __name__=="__main__":